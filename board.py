@@ -0,0 +1,475 @@
+"""チェス盤の状態管理と盤面のHTML
+
+Streamlitはスクリプト (main.py) を再実行のたびに新しいモジュールとして読み直すので、
+駒や盤面の表はこのモジュールに置き、インポート時に一度だけ作る
+"""
+
+from dataclasses import dataclass, field
+from enum import IntEnum
+
+from engine import RustEngine
+
+
+class PieceColor(IntEnum):
+    """駒の色"""
+
+    WHITE = 0
+    BLACK = 1
+
+
+class PieceType(IntEnum):
+    """駒の種類（Rust AIのビットボードと同じ順序）"""
+
+    PAWN = 0
+    KNIGHT = 1
+    BISHOP = 2
+    ROOK = 3
+    QUEEN = 4
+    KING = 5
+
+
+# 駒のUnicode文字 (インデックス = color * 6 + piece_type)
+_UNICODE: tuple[str, ...] = (
+    *("♙", "♘", "♗", "♖", "♕", "♔"),  # 白
+    *("♟", "♞", "♝", "♜", "♛", "♚"),  # 黒
+)
+
+
+# 駒の種類ごとの棋譜の接頭辞 (インデックス = piece_type、ポーンは接頭辞なし)
+_PREFIX: tuple[str, ...] = ("", "N", "B", "R", "Q", "K")
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class Piece:
+    """チェスの駒（12種類のインスタンスを共有して使う）"""
+
+    piece_type: PieceType
+    color: PieceColor
+    # 駒のUnicode文字（生成時に一度だけ引く）
+    symbol: str = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "symbol", _UNICODE[self.color * 6 + self.piece_type])
+
+    def get_unicode(self) -> str:
+        """駒のUnicode文字を返す"""
+        return self.symbol
+
+
+# 共有の駒インスタンス
+_WP = Piece(PieceType.PAWN, PieceColor.WHITE)
+_WN = Piece(PieceType.KNIGHT, PieceColor.WHITE)
+_WB = Piece(PieceType.BISHOP, PieceColor.WHITE)
+_WR = Piece(PieceType.ROOK, PieceColor.WHITE)
+_WQ = Piece(PieceType.QUEEN, PieceColor.WHITE)
+_WK = Piece(PieceType.KING, PieceColor.WHITE)
+_BP = Piece(PieceType.PAWN, PieceColor.BLACK)
+_BN = Piece(PieceType.KNIGHT, PieceColor.BLACK)
+_BB = Piece(PieceType.BISHOP, PieceColor.BLACK)
+_BR = Piece(PieceType.ROOK, PieceColor.BLACK)
+_BQ = Piece(PieceType.QUEEN, PieceColor.BLACK)
+_BK = Piece(PieceType.KING, PieceColor.BLACK)
+
+# ビットボードのインデックス: color * 6 + piece_type の順序
+_PIECE_CACHE: tuple[Piece, ...] = (
+    _WP,
+    _WN,
+    _WB,
+    _WR,
+    _WQ,
+    _WK,
+    _BP,
+    _BN,
+    _BB,
+    _BR,
+    _BQ,
+    _BK,
+)
+# 盤面の駒コード -> 駒 (0 は空きマス、ビットボードのインデックス + 1 が駒コード)
+_DECODE: tuple[Piece | None, ...] = (None, *_PIECE_CACHE)
+
+# Rust AIの盤面出力の文字とPieceへのマッピング
+_PIECE_MAP: dict[str, Piece | None] = {
+    "P": _WP,
+    "N": _WN,
+    "B": _WB,
+    "R": _WR,
+    "Q": _WQ,
+    "K": _WK,
+    "p": _BP,
+    "n": _BN,
+    "b": _BB,
+    "r": _BR,
+    "q": _BQ,
+    "k": _BK,
+    ".": None,
+}
+
+
+def _bb_index(piece: Piece) -> int:
+    """駒に対応するビットボードのインデックスを返す"""
+    return piece.color * 6 + piece.piece_type
+
+
+# ポーンが昇格するランク (インデックス = color、白は8th rank、黒は1st rank)
+_PROMOTION_RANKS: tuple[int, ...] = (7, 0)
+# キングとルークの初期位置のランク (インデックス = color)
+_HOME_RANKS: tuple[int, ...] = (0, 7)
+
+# マス名 (インデックス = rank * 8 + file)
+_SQUARE_NAMES: tuple[str, ...] = tuple(
+    f"{c}{r + 1}" for r in range(8) for c in "abcdefgh"
+)
+
+# FENの盤面フィールドを駒コード (0: 空きマス、1..12) の文字の並びに変換する
+# (駒をコードに、空きマス数をその数の 0 に置き換え、ランク区切りの '/' を取り除く)
+_FEN_CODES: dict[int, str | None] = str.maketrans(
+    {c: chr(_bb_index(p) + 1) for c, p in _PIECE_MAP.items() if p is not None}
+    | {str(n): "\0" * n for n in range(1, 9)}
+    | {"/": None}
+)
+
+# マスごとのCSSクラス (インデックス = rank * 8 + file、a1は暗いマス)
+_SQ_CLASS: tuple[str, ...] = tuple(
+    "light-square" if (r + f) % 2 == 1 else "dark-square"
+    for r in range(8)
+    for f in range(8)
+)
+
+# マスごとの開始タグ (インデックス = rank * 8 + file)、通常時と選択中の2通り
+_SQ_TD: tuple[str, ...] = tuple(
+    f'<td class="{_SQ_CLASS[sq]}" data-rank="{sq // 8}" data-file="{sq % 8}"'
+    f' title="{_SQUARE_NAMES[sq]}">'
+    for sq in range(64)
+)
+_SQ_TD_SELECTED: tuple[str, ...] = tuple(
+    td.replace('-square"', '-square selected-square"', 1) for td in _SQ_TD
+)
+
+# 盤面下端のファイル名のラベル行と、左右にランク番号を付けた各ランクの行の両端
+_BOARD_LABEL_ROW: str = (
+    "<tr><th></th>" + "".join(f"<th>{c}</th>" for c in "abcdefgh") + "<th></th></tr>"
+)
+_RANK_ROW_OPEN: tuple[str, ...] = tuple(f"<tr><th>{r + 1}</th>" for r in range(8))
+_RANK_ROW_CLOSE: tuple[str, ...] = tuple(f"<th>{r + 1}</th></tr>" for r in range(8))
+
+# 初期配置のビットボード (bit = rank * 8 + file, a1 = bit 0)
+_INITIAL_BITBOARDS: tuple[int, ...] = (
+    0x000000000000FF00,  # 白ポーン
+    0x0000000000000042,  # 白ナイト
+    0x0000000000000024,  # 白ビショップ
+    0x0000000000000081,  # 白ルーク
+    0x0000000000000008,  # 白クイーン
+    0x0000000000000010,  # 白キング
+    0x00FF000000000000,  # 黒ポーン
+    0x4200000000000000,  # 黒ナイト
+    0x2400000000000000,  # 黒ビショップ
+    0x8100000000000000,  # 黒ルーク
+    0x0800000000000000,  # 黒クイーン
+    0x1000000000000000,  # 黒キング
+)
+
+
+class ChessBoard:
+    """チェス盤の状態管理"""
+
+    def __init__(self, engine: RustEngine) -> None:
+        """初期配置でチェス盤を初期化"""
+        self.engine: RustEngine = engine
+        # (色, 駒種) ごとのビットボードと全駒の占有ビットボード
+        self.bb: list[int] = [0] * 12
+        self.occupancy: int = 0
+        # マスごとの駒コード (rank * 8 + file -> 0: 空きマス、1..12: _DECODE で駒に対応)
+        self._cells: bytearray = bytearray(64)
+        # ローカルの盤面がRust AIとずれている可能性があるか
+        self._needs_sync: bool = False
+        self.selected_square: tuple[int, int] | None = None
+        self.move_history: list[str] = []
+        # move_history を空白区切りで連結した棋譜（手を追加するたびに末尾へ追記）
+        self._kifu_str: str = ""
+        self._setup_initial_position()
+        # Rust AI側の局面も初期配置に揃える
+        self.engine.set_position("")
+
+    def _setup_initial_position(self) -> None:
+        """初期配置をセットアップ"""
+        self.bb = list(_INITIAL_BITBOARDS)
+        self._refresh_derived()
+
+    def _refresh_derived(self) -> None:
+        """ビットボードから占有ビットボードとマスごとの駒を再構築"""
+        occupancy: int = 0
+        for b in self.bb:
+            occupancy |= b
+        self.occupancy = occupancy
+
+        # 新しい bytearray を作らずにその場でクリアする
+        self._cells[:] = bytes(64)
+        for i, b in enumerate(self.bb):
+            while b:
+                lsb: int = b & -b
+                self._cells[lsb.bit_length() - 1] = i + 1
+                b ^= lsb
+
+    def get_piece(self, rank: int, file: int) -> Piece | None:
+        """指定位置の駒を取得"""
+        return _DECODE[self._cells[rank * 8 + file]]
+
+    def move_piece(
+        self, from_rank: int, from_file: int, to_rank: int, to_file: int
+    ) -> bool:
+        """駒を移動する"""
+        piece: Piece | None = self.get_piece(from_rank, from_file)
+        if piece is None:
+            return False
+
+        # 移動を記録
+        from_square: str = self._square_to_notation(from_rank, from_file)
+        to_square: str = self._square_to_notation(to_rank, to_file)
+        captured: Piece | None = self.get_piece(to_rank, to_file)
+
+        # 駒の種類記号を取得
+        piece_prefix: str = self._get_piece_prefix(piece)
+
+        # プロモーションをチェック
+        is_promotion: bool = self._is_promotion(piece, to_rank)
+
+        # 移動の表記を作成
+        if captured:
+            move_str = f"{piece_prefix}{from_square}x{to_square}"
+        else:
+            move_str = f"{piece_prefix}{from_square}{to_square}"
+
+        # プロモーションの場合は=Qを追加
+        if is_promotion:
+            move_str += "=Q"
+
+        # 駒を移動
+        from_sq: int = from_rank * 8 + from_file
+        to_sq: int = to_rank * 8 + to_file
+        from_mask: int = 1 << from_sq
+        to_mask: int = 1 << to_sq
+        code: int = self._cells[from_sq]
+        if captured:
+            self.bb[self._cells[to_sq] - 1] &= ~to_mask
+        elif piece.piece_type is PieceType.PAWN and from_file != to_file:
+            # アンパッサンで取られるポーンはローカルでは除去しないのでRust AIと同期する
+            self._needs_sync = True
+        self.bb[code - 1] &= ~from_mask
+        if is_promotion:
+            # クイーンに成る
+            code = piece.color * 6 + PieceType.QUEEN + 1
+        self.bb[code - 1] |= to_mask
+        self.occupancy = (self.occupancy & ~from_mask) | to_mask
+        self._cells[to_sq] = code
+        self._cells[from_sq] = 0
+
+        # 棋譜に追加
+        self._append_move(move_str)
+
+        return True
+
+    def _is_promotion(self, piece: Piece, to_rank: int) -> bool:
+        """プロモーションかどうかをチェック"""
+        return (
+            piece.piece_type is PieceType.PAWN
+            and _PROMOTION_RANKS[piece.color] == to_rank
+        )
+
+    def _get_piece_prefix(self, piece: Piece) -> str:
+        """駒の種類に応じた接頭辞を返す"""
+        return _PREFIX[piece.piece_type]
+
+    def _square_to_notation(self, rank: int, file: int) -> str:
+        """座標をチェス記法に変換"""
+        return _SQUARE_NAMES[rank * 8 + file]
+
+    def select_square(self, rank: int, file: int) -> None:
+        """マスを選択"""
+        # 既に選択されている場合は移動を試みる
+        if self.selected_square is not None:
+            from_rank, from_file = self.selected_square
+            if (from_rank, from_file) != (rank, file):
+                # キャスリングかチェック
+                castling_notation: str | None = self._check_castling(
+                    from_rank, from_file, rank, file
+                )
+                moved: bool = True
+                if castling_notation:
+                    moved = self._record_castling(
+                        castling_notation, rank, from_file, file
+                    )
+                else:
+                    moved = self.move_piece(from_rank, from_file, rank, file)
+                # 移動後、増えた手だけをRust AIに送る
+                if moved:
+                    self._sync_new_moves_with_rust()
+            self.selected_square = None
+        else:
+            # 駒がある場合のみ選択
+            if self.occupancy >> (rank * 8 + file) & 1:
+                self.selected_square = (rank, file)
+
+    def _check_castling(
+        self, from_rank: int, from_file: int, to_rank: int, to_file: int
+    ) -> str | None:
+        """キャスリングかどうかをチェックし、該当する場合は記法を返す"""
+        if from_rank != to_rank:
+            return None
+        piece: Piece | None = self.get_piece(from_rank, from_file)
+        if piece is None or piece.piece_type != PieceType.KING:
+            return None
+
+        # キングの移動が2マス以上の場合はキャスリング
+        file_diff: int = abs(to_file - from_file)
+        if file_diff == 2:
+            # キングサイド（右）: O-O
+            if to_file > from_file:
+                return "O-O"
+            # クイーンサイド（左）: O-O-O
+            else:
+                return "O-O-O"
+
+        return None
+
+    def _record_castling(
+        self, notation: str, rank: int, from_file: int, to_file: int
+    ) -> bool:
+        """キャスリングを記録し、キングとルークを動かす（できない配置なら何もしない）"""
+        # キングサイドはhファイルのルークがfファイルへ、クイーンサイドはaファイルのルークがdファイルへ
+        rook_from, rook_to = (7, 5) if to_file > from_file else (0, 3)
+        king_sq: int = rank * 8 + from_file
+        rook_sq: int = rank * 8 + rook_from
+        king: Piece | None = _DECODE[self._cells[king_sq]]
+        if king is None:
+            return False
+        # キングが初期位置にあり、同じ色のルークが隅にあり、間のマスが空いている場合のみ
+        rook_code: int = king.color * 6 + PieceType.ROOK + 1
+        between: range = range(min(king_sq, rook_sq) + 1, max(king_sq, rook_sq))
+        if (
+            from_file != 4
+            or rank != _HOME_RANKS[king.color]
+            or self._cells[rook_sq] != rook_code
+            or any(self._cells[sq] for sq in between)
+        ):
+            return False
+        self._relocate(king_sq, rank * 8 + to_file)
+        self._relocate(rook_sq, rank * 8 + rook_to)
+        self._append_move(notation)
+        return True
+
+    def _relocate(self, from_sq: int, to_sq: int) -> None:
+        """駒を空きマスへ動かす"""
+        code: int = self._cells[from_sq]
+        self.bb[code - 1] ^= (1 << from_sq) | (1 << to_sq)
+        self.occupancy ^= (1 << from_sq) | (1 << to_sq)
+        self._cells[to_sq] = code
+        self._cells[from_sq] = 0
+
+    def _append_move(self, move_str: str) -> None:
+        """棋譜に一手追加"""
+        self.move_history.append(move_str)
+        self._kifu_str = f"{self._kifu_str} {move_str}" if self._kifu_str else move_str
+
+    def get_kifu_string(self) -> str:
+        """棋譜を文字列として取得(URL用)"""
+        return self._kifu_str
+
+    def load_kifu_from_string(self, kifu_string: str) -> bool:
+        """棋譜文字列を読み込んで盤面を再構築"""
+        if not kifu_string:
+            return False
+
+        try:
+            # 棋譜を空白で分割して移動履歴に設定（split() は前後の空白も無視する）
+            self.move_history = kifu_string.split()
+            self._kifu_str = " ".join(self.move_history)
+
+            # Rust AIと同期して正しい盤面を取得
+            return self.sync_board_with_rust()
+        except Exception:
+            return False
+
+    def sync_board_with_rust(self) -> bool:
+        """Rust AIに棋譜全体を送り、盤面の状態を取得して同期"""
+        kifu: str = self.get_kifu_string()
+
+        # 棋譜が空の場合は同期不要
+        if not kifu:
+            return True
+
+        if not self.engine.set_position(kifu):
+            return False
+        return self._update_board_from_rust()
+
+    def _sync_new_moves_with_rust(self) -> bool:
+        """増えた手だけをRust AIの局面に適用し、必要な場合のみ盤面を同期"""
+        # Rust AI側の局面がずれている場合は棋譜全体が送り直される
+        if not self.engine.sync(self.move_history):
+            return False
+        # 通常の手はローカルの盤面が正しいので盤面の取得を省く
+        if not self._needs_sync:
+            return True
+        # 盤面を取得できるまでは次の手の後にも同期を試みる
+        if not self._update_board_from_rust():
+            return False
+        self._needs_sync = False
+        return True
+
+    def _update_board_from_rust(self) -> bool:
+        """Rust AIの現在の局面を取得して盤面を更新"""
+        output: str | None = self.engine.print_board()
+        if output is None:
+            return False
+        print("# sync_board_with_rust")
+        print(output)
+
+        # 出力を解析して盤面を更新
+        return self._parse_and_update_board(output)
+
+    def _parse_and_update_board(self, board_fen: str) -> bool:
+        """Rust AIが出力したFENの駒配置を解析して盤面を更新"""
+        # "rnbqkbnr/pppppppp/8/..." を8th rankから順の64個の駒コードに展開
+        # (未知の文字は '?' になり、駒コードの範囲外として弾かれる)
+        codes: bytes = (
+            board_fen.strip().translate(_FEN_CODES).encode("latin-1", "replace")
+        )
+        if len(codes) != 64 or max(codes) > 12:
+            return False
+
+        # ランクを上下反転して rank * 8 + file の順に並べ、マスごとの駒を一度に書き換える
+        self._cells[:] = b"".join(codes[i : i + 8] for i in range(56, -8, -8))
+
+        # マスごとの駒からビットボードを再構築
+        bb: list[int] = [0] * 12
+        for sq, code in enumerate(self._cells):
+            if code:
+                bb[code - 1] |= 1 << sq
+        self.bb = bb
+        occupancy: int = 0
+        for b in bb:
+            occupancy |= b
+        self.occupancy = occupancy
+        return True
+
+
+def build_board_html(chess_board: ChessBoard) -> str:
+    """盤面全体を1つのHTMLテーブルとして組み立てる"""
+    selected: tuple[int, int] | None = chess_board.selected_square
+    selected_sq: int = selected[0] * 8 + selected[1] if selected else -1
+
+    # 8x8の盤面(上から8th rank)、左右にランク番号
+    parts: list[str] = ['<table class="chess-board">']
+    for rank in range(7, -1, -1):
+        parts.append(_RANK_ROW_OPEN[rank])
+        for file in range(8):
+            sq: int = rank * 8 + file
+            piece: Piece | None = chess_board.get_piece(rank, file)
+            parts.append(_SQ_TD_SELECTED[sq] if sq == selected_sq else _SQ_TD[sq])
+            if piece:
+                parts.append(piece.symbol)
+            parts.append("</td>")
+        parts.append(_RANK_ROW_CLOSE[rank])
+    parts.append(_BOARD_LABEL_ROW)
+    parts.append("</table>")
+    return "".join(parts)
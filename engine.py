@@ -0,0 +1,162 @@
+"""常駐モード (--daemon) のRust AIとの通信"""
+
+import os
+import subprocess
+import threading
+
+import streamlit as st
+
+# Rustのクレートのあるディレクトリ
+_MODULE_DIR: str = os.path.dirname(os.path.abspath(__file__))
+
+
+@st.cache_resource
+def _build_engine() -> str:
+    """Rust AIをリリースビルドし、バイナリのパスを返す（サーバープロセスで一度だけ実行）
+
+    ビルドに失敗した場合は例外を送出する（キャッシュされず、次の起動時に再試行される）
+    """
+    subprocess.run(
+        ["cargo", "build", "--release", "--quiet"], cwd=_MODULE_DIR, check=True
+    )
+    return os.path.join(_MODULE_DIR, "target", "release", "greedy-chess")
+
+
+class RustEngine:
+    """常駐モード (--daemon) で起動したRust AIとの通信"""
+
+    def __init__(self) -> None:
+        """Rust AIとの通信を初期化（プロセスは最初のリクエストで起動する）"""
+        # Streamlitの再実行が重なっても1つのパイプで応答が混ざらないようにする
+        self._lock: threading.Lock = threading.Lock()
+        self.process: subprocess.Popen[bytes] | None = None
+        # Rust AI側の現在の局面に至るまでに適用した手（差分だけを送るために保持）
+        # プロセスを強制終了した後など、局面が分からない場合は None
+        self._moves: list[str] | None = []
+
+    def _spawn(self) -> subprocess.Popen[bytes]:
+        """Rust AIをビルドし、バイナリを --daemon で起動"""
+        # プロトコルはASCIIのみなので、テキストモードのデコーダを通さずバイト列でやり取りする
+        return subprocess.Popen(
+            [_build_engine(), "--daemon"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=_MODULE_DIR,
+        )
+
+    def _request(
+        self, command: str, timeout: float = 5.0, sets_position: bool = False
+    ) -> list[str] | None:
+        """コマンドを1行送信し、`ok` までの応答行を返す（失敗時はNone）
+
+        timeout 秒以内に応答が終わらなければプロセスを強制終了する
+        （次のリクエストで起動し直される）
+        sets_position が False のコマンドは現在の局面を前提とするので、
+        動いていたプロセスを起動し直した場合は送らずにNoneを返す
+        """
+        with self._lock:
+            # プロセスが起動していないか終了していれば起動し直す
+            if self.process is None or self.process.poll() is not None:
+                lost: bool = self.process is not None
+                # 新しいプロセスは初期配置から始まる
+                self._moves = []
+                try:
+                    self.process = self._spawn()
+                except (OSError, subprocess.CalledProcessError) as e:
+                    # cargo やバイナリがない、ビルドに失敗した場合など
+                    print(f"# {command}: {e}")
+                    self.process = None
+                    return None
+                # 呼び出し側が想定していた局面は失われている
+                if lost and not sets_position:
+                    return None
+
+            process: subprocess.Popen[bytes] = self.process
+            stdin, stdout = process.stdin, process.stdout
+            if stdin is None or stdout is None:
+                return None
+
+            watchdog = threading.Timer(timeout, process.kill)
+            watchdog.start()
+            try:
+                # ASCII以外の文字は '?' になり、Rust AI側で不正な手として弾かれる
+                stdin.write(command.encode("ascii", "replace") + b"\n")
+                stdin.flush()
+                lines: list[bytes] = []
+                # 強制終了された場合は stdout がEOFになりループを抜ける
+                for line in stdout:
+                    line = line.rstrip(b"\n")
+                    if line == b"ok":
+                        return [line.decode("ascii", "replace") for line in lines]
+                    if line.startswith(b"error"):
+                        print(f"# {command}: {line.decode('ascii', 'replace')}")
+                        return None
+                    lines.append(line)
+            except OSError:
+                pass
+            finally:
+                watchdog.cancel()
+            # 応答が途切れたプロセスは確実に終了させ、次のリクエストで起動し直す
+            process.kill()
+            process.wait()
+            self._moves = None
+            return None
+
+    def stop(self) -> None:
+        """実行中のリクエストを打ち切る（プロセスは次のリクエストで起動し直される）"""
+        process: subprocess.Popen[bytes] | None = self.process
+        if process is not None:
+            process.kill()
+            # 終了を待ち、次のリクエストで確実に起動し直されるようにする
+            process.wait()
+        # 次の sync では棋譜全体を送り直す
+        self._moves = None
+
+    def set_position(self, kifu: str) -> bool:
+        """初期配置から棋譜を適用した局面を設定"""
+        if self._request(f"position {kifu}", sets_position=True) is None:
+            return False
+        self._moves = kifu.split()
+        return True
+
+    def play(self, moves: list[str]) -> bool:
+        """現在の局面に手を適用（途中の手が不正なら局面は変わらない）"""
+        # プロセスが起動し直された場合は局面が失われているので適用されない
+        if self._moves is None:
+            return False
+        if self._request(f"move {' '.join(moves)}") is None:
+            return False
+        self._moves.extend(moves)
+        return True
+
+    def sync(self, moves: list[str]) -> bool:
+        """指定した手順の局面に揃える
+
+        現在の局面の続きであれば増えた手だけを送り、そうでなければ棋譜全体を送り直す
+        """
+        # 局面が分からない場合や続きでない場合は棋譜全体を送り直す
+        sent: list[str] | None = self._moves
+        if (
+            sent is not None
+            and moves[: len(sent)] == sent
+            and (len(moves) == len(sent) or self.play(moves[len(sent) :]))
+        ):
+            return True
+        return self.set_position(" ".join(moves))
+
+    def print_board(self) -> str | None:
+        """現在の局面の駒配置をFENの盤面フィールド形式で取得"""
+        lines: list[str] | None = self._request("print")
+        if not lines:
+            return None
+        return lines[0]
+
+    def best_move(self, timeout: int, threads: int, evaluator: str) -> str | None:
+        """現在の局面の最善手を取得"""
+        lines: list[str] | None = self._request(
+            f"go {timeout} {threads} {evaluator}", timeout=timeout + 1.0
+        )
+        # go の応答は最善手の1行だけ
+        if not lines:
+            return None
+        return lines[0].strip()
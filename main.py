@@ -1,411 +1,87 @@
 import os
-import subprocess
-from dataclasses import dataclass
-from enum import Enum
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import streamlit as st
+import streamlit.components.v1 as components
 
+from board import ChessBoard, build_board_html
+from engine import RustEngine
 
-class PieceColor(Enum):
-    """駒の色"""
-
-    WHITE = "white"
-    BLACK = "black"
-
-
-class PieceType(Enum):
-    """駒の種類"""
-
-    PAWN = "pawn"
-    KNIGHT = "knight"
-    BISHOP = "bishop"
-    ROOK = "rook"
-    QUEEN = "queen"
-    KING = "king"
-
-
-@dataclass
-class Piece:
-    """チェスの駒"""
-
-    piece_type: PieceType
-    color: PieceColor
-
-    def get_unicode(self) -> str:
-        """駒のUnicode文字を返す"""
-        pieces = {
-            (PieceColor.WHITE, PieceType.KING): "♔",
-            (PieceColor.WHITE, PieceType.QUEEN): "♕",
-            (PieceColor.WHITE, PieceType.ROOK): "♖",
-            (PieceColor.WHITE, PieceType.BISHOP): "♗",
-            (PieceColor.WHITE, PieceType.KNIGHT): "♘",
-            (PieceColor.WHITE, PieceType.PAWN): "♙",
-            (PieceColor.BLACK, PieceType.KING): "♚",
-            (PieceColor.BLACK, PieceType.QUEEN): "♛",
-            (PieceColor.BLACK, PieceType.ROOK): "♜",
-            (PieceColor.BLACK, PieceType.BISHOP): "♝",
-            (PieceColor.BLACK, PieceType.KNIGHT): "♞",
-            (PieceColor.BLACK, PieceType.PAWN): "♟",
-        }
-        return pieces[(self.color, self.piece_type)]
-
-
-class ChessBoard:
-    """チェス盤の状態管理"""
-
-    def __init__(self) -> None:
-        """初期配置でチェス盤を初期化"""
-        self.board: list[list[Piece | None]] = [
-            [None for _ in range(8)] for _ in range(8)
-        ]
-        self.selected_square: tuple[int, int] | None = None
-        self.move_history: list[str] = []
-        self._setup_initial_position()
-
-    def _setup_initial_position(self) -> None:
-        """初期配置をセットアップ"""
-        # 黒の駒(8th rank)
-        self.board[7][0] = Piece(PieceType.ROOK, PieceColor.BLACK)
-        self.board[7][1] = Piece(PieceType.KNIGHT, PieceColor.BLACK)
-        self.board[7][2] = Piece(PieceType.BISHOP, PieceColor.BLACK)
-        self.board[7][3] = Piece(PieceType.QUEEN, PieceColor.BLACK)
-        self.board[7][4] = Piece(PieceType.KING, PieceColor.BLACK)
-        self.board[7][5] = Piece(PieceType.BISHOP, PieceColor.BLACK)
-        self.board[7][6] = Piece(PieceType.KNIGHT, PieceColor.BLACK)
-        self.board[7][7] = Piece(PieceType.ROOK, PieceColor.BLACK)
-
-        # 黒のポーン(7th rank)
-        for file in range(8):
-            self.board[6][file] = Piece(PieceType.PAWN, PieceColor.BLACK)
-
-        # 白のポーン(2nd rank)
-        for file in range(8):
-            self.board[1][file] = Piece(PieceType.PAWN, PieceColor.WHITE)
-
-        # 白の駒(1st rank)
-        self.board[0][0] = Piece(PieceType.ROOK, PieceColor.WHITE)
-        self.board[0][1] = Piece(PieceType.KNIGHT, PieceColor.WHITE)
-        self.board[0][2] = Piece(PieceType.BISHOP, PieceColor.WHITE)
-        self.board[0][3] = Piece(PieceType.QUEEN, PieceColor.WHITE)
-        self.board[0][4] = Piece(PieceType.KING, PieceColor.WHITE)
-        self.board[0][5] = Piece(PieceType.BISHOP, PieceColor.WHITE)
-        self.board[0][6] = Piece(PieceType.KNIGHT, PieceColor.WHITE)
-        self.board[0][7] = Piece(PieceType.ROOK, PieceColor.WHITE)
-
-    def get_piece(self, rank: int, file: int) -> Piece | None:
-        """指定位置の駒を取得"""
-        return self.board[rank][file]
-
-    def move_piece(
-        self, from_rank: int, from_file: int, to_rank: int, to_file: int
-    ) -> bool:
-        """駒を移動する"""
-        piece: Piece | None = self.board[from_rank][from_file]
-        if piece is None:
-            return False
-
-        # 移動を記録
-        from_square: str = self._square_to_notation(from_rank, from_file)
-        to_square: str = self._square_to_notation(to_rank, to_file)
-        captured: Piece | None = self.board[to_rank][to_file]
-
-        # 駒の種類記号を取得
-        piece_prefix: str = self._get_piece_prefix(piece)
-
-        # プロモーションをチェック
-        is_promotion: bool = self._is_promotion(piece, to_rank)
-
-        # 移動の表記を作成
-        if captured:
-            move_str = f"{piece_prefix}{from_square}x{to_square}"
-        else:
-            move_str = f"{piece_prefix}{from_square}{to_square}"
-
-        # プロモーションの場合は=Qを追加
-        if is_promotion:
-            move_str += "=Q"
-
-        # 駒を移動
-        self.board[to_rank][to_file] = piece
-        self.board[from_rank][from_file] = None
-
-        # 棋譜に追加
-        self.move_history.append(move_str)
-
-        return True
-
-    def _is_promotion(self, piece: Piece, to_rank: int) -> bool:
-        """プロモーションかどうかをチェック"""
-        if piece.piece_type != PieceType.PAWN:
-            return False
-
-        # 白のポーンが8th rank(rank=7)に到達
-        if piece.color == PieceColor.WHITE and to_rank == 7:
-            return True
-
-        # 黒のポーンが1st rank(rank=0)に到達
-        if piece.color == PieceColor.BLACK and to_rank == 0:
-            return True
-
-        return False
-
-    def _get_piece_prefix(self, piece: Piece) -> str:
-        """駒の種類に応じた接頭辞を返す"""
-        piece_prefixes = {
-            PieceType.KING: "K",
-            PieceType.QUEEN: "Q",
-            PieceType.ROOK: "R",
-            PieceType.BISHOP: "B",
-            PieceType.KNIGHT: "N",
-            PieceType.PAWN: "",  # ポーンは接頭辞なし
-        }
-        return piece_prefixes.get(piece.piece_type, "")
-
-    def _square_to_notation(self, rank: int, file: int) -> str:
-        """座標をチェス記法に変換"""
-        files: str = "abcdefgh"
-        return f"{files[file]}{rank + 1}"
-
-    def select_square(self, rank: int, file: int) -> None:
-        """マスを選択"""
-        # 既に選択されている場合は移動を試みる
-        if self.selected_square is not None:
-            from_rank, from_file = self.selected_square
-            if (from_rank, from_file) != (rank, file):
-                # キャスリングかチェック
-                castling_notation: str | None = self._check_castling(
-                    from_rank, from_file, rank, file
-                )
-                if castling_notation:
-                    self._record_castling(castling_notation)
-                else:
-                    self.move_piece(from_rank, from_file, rank, file)
-                # 移動後、Rust AIと同期
-                self.sync_board_with_rust()
-            self.selected_square = None
-        else:
-            # 駒がある場合のみ選択
-            if self.board[rank][file] is not None:
-                self.selected_square = (rank, file)
-
-    def _check_castling(
-        self, from_rank: int, from_file: int, to_rank: int, to_file: int
-    ) -> str | None:
-        """キャスリングかどうかをチェックし、該当する場合は記法を返す"""
-        if from_rank != to_rank:
-            return None
-        piece: Piece | None = self.board[from_rank][from_file]
-        if piece is None or piece.piece_type != PieceType.KING:
-            return None
-
-        # キングの移動が2マス以上の場合はキャスリング
-        file_diff: int = abs(to_file - from_file)
-        if file_diff == 2:
-            # キングサイド（右）: O-O
-            if to_file > from_file:
-                return "O-O"
-            # クイーンサイド（左）: O-O-O
-            else:
-                return "O-O-O"
+# このファイルのあるディレクトリ（盤面コンポーネントの置き場所）
+_MODULE_DIR: str = os.path.dirname(os.path.abspath(__file__))
 
-        return None
 
-    def _record_castling(self, notation: str) -> None:
-        """キャスリングを記録"""
-        self.move_history.append(notation)
-
-    def get_kifu_string(self) -> str:
-        """棋譜を文字列として取得(URL用)"""
-        return " ".join(self.move_history)
-
-    def load_kifu_from_string(self, kifu_string: str) -> bool:
-        """棋譜文字列を読み込んで盤面を再構築"""
-        if not kifu_string:
-            return False
-
-        try:
-            # 棋譜を空白で分割して移動履歴に設定
-            self.move_history = kifu_string.strip().split()
-
-            # Rust AIと同期して正しい盤面を取得
-            return self.sync_board_with_rust()
-        except Exception:
-            return False
-
-    def get_best_move(
-        self, timeout: int, threads: int = 1, evaluator: str = "default"
-    ) -> str | None:
-        """Rust AIから最善手を取得（並列探索）"""
-        kifu: str = self.get_kifu_string()
-
-        # コマンドライン引数を構築
-        cmd = ["cargo", "run", "--release", "--", "-t", str(timeout)]
-        if threads > 1:
-            cmd.extend(["-n", str(threads)])
-        cmd.extend(["-e", evaluator])
-
-        process = subprocess.Popen(
-            cmd,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            cwd=os.path.dirname(os.path.abspath(__file__)),
-        )
-        try:
-            stdout, stderr = process.communicate(input=kifu, timeout=timeout + 1.0)
-            print(f"# get_best_move (evaluator={evaluator})")
-            print(stdout)
-            print(stderr)
-            if process.returncode == 0:
-                output_lines: list[str] = stdout.strip().split("\n")
-                if output_lines:
-                    lines = [line for line in output_lines if not line.startswith(";")]
-                    return lines[0].strip()
-            return None
-        except subprocess.TimeoutExpired:
-            process.kill()
-            return None
-        except Exception:
-            return None
-
-    def sync_board_with_rust(self) -> bool:
-        """Rust AIから盤面の状態を取得して同期"""
-        kifu: str = self.get_kifu_string()
-
-        # 棋譜が空の場合は同期不要
-        if not kifu:
-            return True
-
-        try:
-            # cargo run --release -- -p を実行
-            process = subprocess.Popen(
-                ["cargo", "run", "--release", "--", "-p"],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                cwd=os.path.dirname(os.path.abspath(__file__)),
-            )
-
-            # 棋譜を標準入力に渡す
-            stdout, stderr = process.communicate(input=kifu, timeout=5)
-            print("# sync_board_with_rust")
-            print(stdout)
-            print(stderr)
-
-            if process.returncode == 0:
-                # 出力を解析して盤面を更新
-                self._parse_and_update_board(stdout)
-                return True
-
-            return False
-        except Exception:
-            return False
-
-    def _parse_and_update_board(self, rust_output: str) -> None:
-        """Rust AIの出力を解析して盤面を更新"""
-        lines: list[str] = rust_output.strip().split("\n")
-
-        # 駒の文字とPieceへのマッピング
-        piece_map = {
-            "P": Piece(PieceType.PAWN, PieceColor.WHITE),
-            "N": Piece(PieceType.KNIGHT, PieceColor.WHITE),
-            "B": Piece(PieceType.BISHOP, PieceColor.WHITE),
-            "R": Piece(PieceType.ROOK, PieceColor.WHITE),
-            "Q": Piece(PieceType.QUEEN, PieceColor.WHITE),
-            "K": Piece(PieceType.KING, PieceColor.WHITE),
-            "p": Piece(PieceType.PAWN, PieceColor.BLACK),
-            "n": Piece(PieceType.KNIGHT, PieceColor.BLACK),
-            "b": Piece(PieceType.BISHOP, PieceColor.BLACK),
-            "r": Piece(PieceType.ROOK, PieceColor.BLACK),
-            "q": Piece(PieceType.QUEEN, PieceColor.BLACK),
-            "k": Piece(PieceType.KING, PieceColor.BLACK),
-            ".": None,
-        }
-
-        # 盤面をクリア
-        self.board = [[None for _ in range(8)] for _ in range(8)]
-
-        # 各行を解析
-        for line in lines:
-            if not line.startswith(";"):
-                continue
-
-            # "; 8 r n b q k b n r" のような形式
-            parts: list[str] = line.split()
-            if len(parts) < 10:  # "; " + rank + 8 pieces
-                continue
-
-            # ランク番号を取得 (1-8)
-            try:
-                rank_num: int = int(parts[1])
-            except (ValueError, IndexError):
-                continue
-
-            # ランク番号を配列インデックスに変換 (0-7)
-            rank: int = rank_num - 1
-
-            # 各ファイルの駒を解析
-            for file in range(8):
-                if file + 2 < len(parts):
-                    piece_char: str = parts[file + 2]
-                    if piece_char in piece_map:
-                        self.board[rank][file] = piece_map[piece_char]
+# 盤面を描画するカスタムコンポーネント（クリックされたマスを返す）
+_board_component = components.declare_component(
+    "chess_board",
+    path=os.path.join(_MODULE_DIR, "board_component"),
+)
 
 
 def render_chess_board(chess_board: ChessBoard) -> None:
     """チェス盤をレンダリング"""
-    # ファイル名のラベル
-    col_labels: list[str] = ["a", "b", "c", "d", "e", "f", "g", "h"]
-
-    # 8x8の盤面を表示(上から8th rank)
-    for rank in range(7, -1, -1):
-        cols = st.columns([0.5] + [1] * 8 + [0.5])
-
-        # ランク番号(左)
-        with cols[0]:
-            st.markdown(
-                f"<div style='text-align: center; font-weight: bold;'>{rank + 1}</div>",
-                unsafe_allow_html=True,
-            )
-
-        # 各マス
-        for file in range(8):
-            with cols[file + 1]:
-                piece: Piece | None = chess_board.get_piece(rank, file)
-                piece_symbol: str = piece.get_unicode() if piece else ""
-
-                # 明るいマス（白）か暗いマス（灰色）かを判定
-                is_light: bool = (rank + file) % 2 == 0
-                button_type: str = "secondary" if is_light else "tertiary"
-
-                # ボタンで各マスを作成
-                if st.button(
-                    piece_symbol,
-                    key=f"sq_{rank}_{file}",
-                    type=button_type,
-                    help=f"{col_labels[file]}{rank + 1}",
-                    use_container_width=True,
-                ):
-                    chess_board.select_square(rank, file)
-                    st.rerun()
-
-        # ランク番号(右)
-        with cols[9]:
-            st.markdown(
-                f"<div style='text-align: center; font-weight: bold;'>{rank + 1}</div>",
-                unsafe_allow_html=True,
-            )
-
-    # ファイル名のラベル
-    cols = st.columns([0.5] + [1] * 8 + [0.5])
-    for i, label in enumerate(col_labels):
-        with cols[i + 1]:
-            st.markdown(
-                f"<div style='text-align: center; font-weight: bold;'>{label}</div>",
-                unsafe_allow_html=True,
-            )
+    # 棋譜か選択中のマスが変わったときだけHTMLを組み立て直す
+    html_key: tuple[str, tuple[int, int] | None] = (
+        chess_board.get_kifu_string(),
+        chess_board.selected_square,
+    )
+    cached: tuple[tuple[str, tuple[int, int] | None], str] | None = (
+        st.session_state.get("board_html")
+    )
+    if cached is None or cached[0] != html_key:
+        cached = (html_key, build_board_html(chess_board))
+        st.session_state.board_html = cached
+
+    # 盤面は1つのコンポーネントとして描画し、クリックされたマスだけを受け取る
+    # (キーは ChessBoard を保持する session_state.chess_board と衝突しない名前にする)
+    click: dict[str, int] | None = _board_component(
+        board_html=cached[1], key="board_click", default=None
+    )
+
+    # 前回の実行で処理したクリックの値が返り続けるので、新しいクリックだけを処理する
+    if click and click["nonce"] != st.session_state.get("board_click_nonce"):
+        st.session_state.board_click_nonce = click["nonce"]
+        chess_board.select_square(click["rank"], click["file"])
+        st.rerun()
+
+
+# 全セッションで共有するAI推奨手のキャッシュの最大件数と保持期間 (秒)
+_BEST_MOVE_CACHE_SIZE: int = 512
+_BEST_MOVE_CACHE_TTL: int = 3600
+# AI思考中に結果を確認しにいく間隔 (秒)
+_BEST_MOVE_POLL_INTERVAL: float = 0.2
+
+
+def _search_best_move(
+    engine: RustEngine, kifu: str, timeout: int, threads: int, evaluator: str
+) -> str | None:
+    """Rust AIから指定した棋譜の局面の最善手を取得（並列探索）"""
+    # 前回の思考の局面から進んだ手だけを送る
+    if not engine.sync(kifu.split()):
+        return None
+    best_move: str | None = engine.best_move(timeout, threads, evaluator)
+    print(f"# get_best_move (evaluator={evaluator})")
+    print(best_move)
+    return best_move
+
+
+@st.cache_data(
+    max_entries=_BEST_MOVE_CACHE_SIZE, ttl=_BEST_MOVE_CACHE_TTL, show_spinner=False
+)
+def _compute_best_move(
+    kifu: str, timeout: int, threads: int, evaluator: str, _engine: RustEngine
+) -> str:
+    """最善手を取得し、(棋譜, 思考時間, スレッド数, 評価関数) ごとに全セッションで共有する
+
+    取得できなかった場合はキャッシュに残さないよう例外を送出する
+    """
+    best_move: str | None = _search_best_move(
+        _engine, kifu, timeout, threads, evaluator
+    )
+    if best_move is None:
+        raise RuntimeError("最善手を取得できませんでした")
+    return best_move
 
 
 def main() -> None:
@@ -413,27 +89,35 @@ def main() -> None:
     st.title("♔  Chess Simulator ♙")
 
     # セッション状態の初期化
+    if "engine" not in st.session_state:
+        st.session_state.engine = RustEngine()
+
+    # AIの思考はバックグラウンドで行い、盤面の操作を待たせない
+    # 盤面用のRust AIと並行して動けるよう、思考用には別のプロセスを使う
+    if "ai_executor" not in st.session_state:
+        st.session_state.ai_engine = RustEngine()
+        st.session_state.ai_executor = ThreadPoolExecutor(max_workers=1)
+        st.session_state.best_move_futures = {}
+
     if "chess_board" not in st.session_state:
-        st.session_state.chess_board = ChessBoard()
+        st.session_state.chess_board = ChessBoard(st.session_state.engine)
 
         # URLパラメータから棋譜を読み込む
         kifu_from_url: str | None = st.query_params.get("kifu", None)
         if kifu_from_url:
             st.session_state.chess_board.load_kifu_from_string(kifu_from_url)
 
-    # AI推奨手のキャッシュを初期化
-    if "best_move_cache" not in st.session_state:
-        st.session_state.best_move_cache = {}
-
     chess_board: ChessBoard = st.session_state.chess_board
 
-    # 棋譜をURLパラメータに反映
+    # 棋譜をURLパラメータに反映（前回反映した棋譜から変わった場合のみ）
     kifu_string: str = chess_board.get_kifu_string()
-    if kifu_string:
-        st.query_params["kifu"] = kifu_string
-    elif "kifu" in st.query_params:
-        # 棋譜が空の場合はパラメータを削除
-        del st.query_params["kifu"]
+    if kifu_string != st.session_state.get("last_kifu"):
+        if kifu_string:
+            st.query_params["kifu"] = kifu_string
+        elif "kifu" in st.query_params:
+            # 棋譜が空の場合はパラメータを削除
+            del st.query_params["kifu"]
+        st.session_state.last_kifu = kifu_string
 
     # レイアウト: 左に盤面、右に棋譜
     col1, col2 = st.columns([2, 1])
@@ -448,7 +132,7 @@ def main() -> None:
 
         # リセットボタン
         if st.button("盤面をリセット", type="secondary"):
-            st.session_state.chess_board = ChessBoard()
+            st.session_state.chess_board = ChessBoard(st.session_state.engine)
             st.rerun()
 
     with col2:
@@ -481,20 +165,46 @@ def main() -> None:
         )
         st.session_state.ai_threads = ai_threads
 
-        current_kifu: str = chess_board.get_kifu_string()
-
         ai_eval = st.toggle("Advanced Evaluator", value=True)
         ai_eval_name = "advanced" if ai_eval else "classic"
-        cache_key = f"{current_kifu}_t{ai_timeout}_n{ai_threads}_{ai_eval_name}"
+        # 棋譜は ChessBoard が保持する同じ文字列なので、タプルのキーはハッシュの再計算なしで引ける
+        # (思考の結果自体は _compute_best_move が全セッションで共有してキャッシュする)
+        cache_key: tuple[str, int, int, str] = (
+            kifu_string,
+            ai_timeout,
+            ai_threads,
+            ai_eval_name,
+        )
 
-        result = None
-        if cache_key in st.session_state.best_move_cache:
-            result = st.session_state.best_move_cache[cache_key]
-        else:
-            with st.spinner(f"AI思考中 ({ai_eval_name})..."):
-                result = chess_board.get_best_move(ai_timeout, ai_threads, ai_eval_name)
-                st.session_state.best_move_cache[cache_key] = result
-        if result:
+        best_move_futures: dict[tuple[str, int, int, str], Future[str]] = (
+            st.session_state.best_move_futures
+        )
+        # 局面や設定が変わったら以前の思考は忘れる（まだ始まっていなければ取り消す）
+        for key in [key for key in best_move_futures if key != cache_key]:
+            stale: Future[str] = best_move_futures.pop(key)
+            if not stale.cancel() and not stale.done():
+                # 実行中の思考は取り消せないので、Rust AIを止めて次の思考を待たせない
+                st.session_state.ai_engine.stop()
+
+        # 現在の局面の思考を始める（キャッシュにあればすぐに終わる）
+        if cache_key not in best_move_futures:
+            best_move_futures[cache_key] = st.session_state.ai_executor.submit(
+                _compute_best_move, *cache_key, st.session_state.ai_engine
+            )
+        future: Future[str] = best_move_futures[cache_key]
+
+        result: str | None = None
+        thinking: bool = not future.done()
+        if not thinking:
+            if future.exception() is None:
+                result = future.result()
+            else:
+                # 失敗した思考は残さず、次の再実行でやり直す
+                del best_move_futures[cache_key]
+
+        if thinking:
+            st.info(f"AI思考中 ({ai_eval_name})...")
+        elif result:
             st.success(f"**{result}**")
         else:
             st.warning("最善手を取得できませんでした")
@@ -517,6 +227,11 @@ def main() -> None:
         else:
             st.info("まだ手が指されていません")
 
+    # 思考が終わるまで少し待って再実行し、結果を確認する
+    if thinking:
+        time.sleep(_BEST_MOVE_POLL_INTERVAL)
+        st.rerun()
+
 
 if __name__ == "__main__":
     main()
@@ -91,6 +91,27 @@ fn to_idx(file: isize, rank: isize) -> usize {
     (rank as usize) * 8 + (file as usize)
 }
 
+/// 駒を1文字で表す（白は大文字、黒は小文字）
+///
+/// # 引数
+/// * `p` - 駒
+fn piece_char(p: Piece) -> char {
+    match (p.kind, p.color) {
+        (Kind::Pawn, Color::White) => 'P',
+        (Kind::Knight, Color::White) => 'N',
+        (Kind::Bishop, Color::White) => 'B',
+        (Kind::Rook, Color::White) => 'R',
+        (Kind::Queen, Color::White) => 'Q',
+        (Kind::King, Color::White) => 'K',
+        (Kind::Pawn, Color::Black) => 'p',
+        (Kind::Knight, Color::Black) => 'n',
+        (Kind::Bishop, Color::Black) => 'b',
+        (Kind::Rook, Color::Black) => 'r',
+        (Kind::Queen, Color::Black) => 'q',
+        (Kind::King, Color::Black) => 'k',
+    }
+}
+
 impl Board {
     /// チェスの初期配置で盤面を作成する
     pub fn new() -> Self {
@@ -181,23 +202,7 @@ impl Board {
                 let i = idx(f, r);
                 match self.sq[i] {
                     None => print!(". "),
-                    Some(p) => {
-                        let c = match (p.kind, p.color) {
-                            (Kind::Pawn, Color::White) => 'P',
-                            (Kind::Knight, Color::White) => 'N',
-                            (Kind::Bishop, Color::White) => 'B',
-                            (Kind::Rook, Color::White) => 'R',
-                            (Kind::Queen, Color::White) => 'Q',
-                            (Kind::King, Color::White) => 'K',
-                            (Kind::Pawn, Color::Black) => 'p',
-                            (Kind::Knight, Color::Black) => 'n',
-                            (Kind::Bishop, Color::Black) => 'b',
-                            (Kind::Rook, Color::Black) => 'r',
-                            (Kind::Queen, Color::Black) => 'q',
-                            (Kind::King, Color::Black) => 'k',
-                        };
-                        print!("{} ", c);
-                    }
+                    Some(p) => print!("{} ", piece_char(p)),
                 }
             }
             println!();
@@ -221,6 +226,36 @@ impl Board {
         println!(";");
     }
 
+    /// 駒配置をFENの盤面フィールド形式の文字列に変換する
+    ///
+    /// 8th rankから順に '/' 区切りで、空きマスの連続は数字で表す
+    /// （初期配置なら "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR"）
+    pub fn board_fen(&self) -> String {
+        let mut result = String::new();
+        for r in (0..8).rev() {
+            let mut empty = 0u8;
+            for f in 0..8 {
+                match self.sq[idx(f, r)] {
+                    None => empty += 1,
+                    Some(p) => {
+                        if empty > 0 {
+                            result.push((b'0' + empty) as char);
+                            empty = 0;
+                        }
+                        result.push(piece_char(p));
+                    }
+                }
+            }
+            if empty > 0 {
+                result.push((b'0' + empty) as char);
+            }
+            if r > 0 {
+                result.push('/');
+            }
+        }
+        result
+    }
+
     /// 手番の色を反転する
     ///
     /// # 引数
@@ -1206,8 +1241,11 @@ impl Board {
         }
 
         loop {
-            // 各深度での探索
-            if let Some(result) = self.search_at_depth(current_depth, start_time, timeout, num_threads.is_some()) {
+            // 各深度での探索（2回目以降は前の深さの最善手から探索する）
+            let prev_best = if current_depth > 1 { Some(best_move) } else { None };
+            if let Some(result) =
+                self.search_at_depth(current_depth, prev_best, start_time, timeout, num_threads.is_some())
+            {
                 best_move = result;
                 eprintln!(
                     "; Completed depth {} (elapsed: {:.2}s)",
@@ -1240,18 +1278,33 @@ impl Board {
     ///
     /// # 引数
     /// * `depth` - 探索深度
+    /// * `prev_best` - 1つ浅い深さでの最善手（先に探索して剪定を効きやすくする）
     /// * `start_time` - 探索開始時刻
     /// * `timeout` - 探索の制限時間
     /// * `parallel` - 並列実行するかどうか
     ///
     /// # 戻り値
     /// タイムアウト前に完了した場合は最適手、タイムアウトした場合はNone
-    fn search_at_depth(&self, depth: u32, start_time: Instant, timeout: Duration, parallel: bool) -> Option<Move> {
-        let moves = self.generate_legal_moves();
+    fn search_at_depth(
+        &self,
+        depth: u32,
+        prev_best: Option<Move>,
+        start_time: Instant,
+        timeout: Duration,
+        parallel: bool,
+    ) -> Option<Move> {
+        let mut moves = self.generate_legal_moves();
         if moves.is_empty() {
             return None;
         }
 
+        // 前の深さの最善手を先頭に移動（他の手の順序は保つ）
+        if let Some(pv) = prev_best {
+            if let Some(pos) = moves.iter().position(|&m| m == pv) {
+                moves[..=pos].rotate_right(1);
+            }
+        }
+
         let maximizing = self.side == Color::White;
 
         if parallel {
@@ -1420,23 +1473,7 @@ impl Board {
         for i in 0..64 {
             match self.sq[i] {
                 None => result.push('.'),
-                Some(p) => {
-                    let c = match (p.kind, p.color) {
-                        (Kind::Pawn, Color::White) => 'P',
-                        (Kind::Knight, Color::White) => 'N',
-                        (Kind::Bishop, Color::White) => 'B',
-                        (Kind::Rook, Color::White) => 'R',
-                        (Kind::Queen, Color::White) => 'Q',
-                        (Kind::King, Color::White) => 'K',
-                        (Kind::Pawn, Color::Black) => 'p',
-                        (Kind::Knight, Color::Black) => 'n',
-                        (Kind::Bishop, Color::Black) => 'b',
-                        (Kind::Rook, Color::Black) => 'r',
-                        (Kind::Queen, Color::Black) => 'q',
-                        (Kind::King, Color::Black) => 'k',
-                    };
-                    result.push(c);
-                }
+                Some(p) => result.push(piece_char(p)),
             }
         }
 
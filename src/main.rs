@@ -7,7 +7,7 @@ use board::Board;
 use cache::Cache;
 use clap::Parser;
 use opening::OpeningBook;
-use std::io::{self, Read};
+use std::io::{self, BufRead, Read, Write};
 use std::time::Duration;
 
 /// 評価関数の種類
@@ -50,26 +50,20 @@ struct Args {
     /// 評価関数の種類 (default, classic)
     #[arg(short = 'e', long, default_value = "advanced")]
     evaluate: EvaluatorType,
+
+    /// 常駐モードで起動し、標準入力から1行ずつコマンドを受け付ける
+    #[arg(long)]
+    daemon: bool,
 }
 
-/// メイン関数
+/// 棋譜のトークン列を初期配置から順次適用した盤面を返す
 ///
-/// 標準入力から棋譜を読み込み、AIが次の最善手を計算して出力する
-/// コマンドライン引数でタイムアウトを指定可能（デフォルト5秒）
-fn main() -> Result<(), Box<dyn std::error::Error>> {
-    let args = Args::parse();
-
-    // 評価関数の種類を設定
-    evaluate::set_evaluator_type(args.evaluate);
-
-    // 標準入力から棋譜（空白区切りの手）を読み、順次適用
-    let mut buf = String::new();
-    io::stdin().read_to_string(&mut buf)?;
-    let tokens: Vec<String> = buf.split_whitespace().map(|s| s.to_string()).collect();
-
+/// # 引数
+/// * `tokens` - 空白区切りの手のトークン列
+fn play_tokens<'a>(tokens: impl Iterator<Item = &'a str>) -> Result<Board, String> {
     let mut board = Board::new();
 
-    for (ply, tok) in tokens.iter().enumerate() {
+    for (ply, tok) in tokens.enumerate() {
         if tok.ends_with('.') {
             continue;
         } // "12." など無視
@@ -81,72 +75,234 @@ fn main() -> Result<(), Box<dyn std::error::Error>> {
         } // セミコロ解説行を無視
 
         if let Err(e) = board.parse_and_play_token(tok) {
-            eprintln!("Failed at ply {} on token '{}': {}", ply + 1, tok, e);
-            return Err(e.into());
+            return Err(format!("Failed at ply {} on token '{}': {}", ply + 1, tok, e));
         }
     }
 
-    // print_only モードなら盤面を表示して終了
-    if args.print_only {
-        board.print_as_comment();
-        return Ok(());
+    Ok(board)
+}
+
+/// 探索で求めた最善手のキャッシュへの書き込み
+///
+/// 常駐モードでは最善手の応答を返してから書き込むために、書き込みを後回しにできるようにする
+struct PendingCacheWrite {
+    cache: Cache,
+    board_state: String,
+    timeout_secs: u64,
+    threads: Option<usize>,
+    evaluator: EvaluatorType,
+    san: String,
+}
+
+impl PendingCacheWrite {
+    /// キャッシュに保存する（失敗しても警告を出すだけ）
+    fn save(self) {
+        if let Err(e) = self.cache.write(
+            &self.board_state,
+            self.timeout_secs,
+            self.threads,
+            self.evaluator,
+            &self.san,
+        ) {
+            eprintln!("; Warning: Failed to write cache: {}", e);
+        }
     }
+}
 
+/// 現在の盤面の最善手をSAN形式で返す
+///
+/// オープニングブック、キャッシュ、反復深化探索の順に試す
+/// 探索した場合はキャッシュへの書き込みを行わずに返すので、呼び出し側で `save` する
+///
+/// # 引数
+/// * `board` - 現在の盤面
+/// * `timeout_secs` - タイムアウト（秒単位）
+/// * `threads` - スレッド数（Noneの場合は直列実行）
+/// * `evaluator` - 評価関数の種類
+fn choose_move(
+    board: &Board,
+    timeout_secs: u64,
+    threads: Option<usize>,
+    evaluator: EvaluatorType,
+) -> Result<(String, Option<PendingCacheWrite>), String> {
     // オープニングブックを初期化
     let opening_book = OpeningBook::new();
 
     // オープニングブックから手を検索（現在の盤面を渡す）
-    let san = if let Some(opening_move) = opening_book.lookup(&board) {
+    if let Some(opening_move) = opening_book.lookup(board) {
         eprintln!("; Using opening book");
-        opening_move
+        return Ok((opening_move, None));
+    }
+
+    // キャッシュを初期化
+    let cache = Cache::new();
+
+    // 盤面をシリアライズしてキャッシュキーを生成
+    let board_state = board.serialize();
+
+    // キャッシュから結果を読み込む
+    if let Some(cached_move) = cache.read(&board_state, timeout_secs, threads, evaluator) {
+        eprintln!("; Using cached result");
+        return Ok((cached_move, None));
+    }
+
+    // 反復深化探索を実行
+    if let Some(n) = threads {
+        eprintln!(
+            "; Using iterative deepening with timeout {}s (parallel, {} threads)",
+            timeout_secs, n
+        );
+    } else {
+        eprintln!(
+            "; Using iterative deepening with timeout {}s (serial)",
+            timeout_secs
+        );
+    }
+    let timeout = Duration::from_secs(timeout_secs);
+    let san = if let Some(best_move) = board.find_best_move(timeout, threads) {
+        board.move_to_san(best_move)
+    } else {
+        eprintln!("No legal moves available");
+        return Err("No legal moves".to_string());
+    };
+
+    // キャッシュに保存する内容
+    let pending = PendingCacheWrite {
+        cache,
+        board_state,
+        timeout_secs,
+        threads,
+        evaluator,
+        san: san.clone(),
+    };
+    Ok((san, Some(pending)))
+}
+
+/// `go <timeout> [threads] [evaluator]` の引数を解析して最善手を返す
+///
+/// # 引数
+/// * `board` - 現在の盤面
+/// * `args` - コマンド名を除いた引数のトークン列
+fn daemon_go<'a>(
+    board: &Board,
+    mut args: impl Iterator<Item = &'a str>,
+) -> Result<(String, Option<PendingCacheWrite>), String> {
+    let timeout_secs: u64 = args
+        .next()
+        .ok_or("Missing timeout")?
+        .parse()
+        .map_err(|e| format!("Invalid timeout: {}", e))?;
+    let threads: usize = match args.next() {
+        Some(t) => t.parse().map_err(|e| format!("Invalid threads: {}", e))?,
+        None => 1,
+    };
+    let evaluator: EvaluatorType = match args.next() {
+        Some(e) => e.parse()?,
+        None => EvaluatorType::Advanced,
+    };
+
+    evaluate::set_evaluator_type(evaluator);
+    if threads > 1 {
+        // リクエストごとにスレッド数が変わり得るので、グローバルではなく専用のプールで探索する
+        let pool = rayon::ThreadPoolBuilder::new()
+            .num_threads(threads)
+            .build()
+            .map_err(|e| e.to_string())?;
+        pool.install(|| choose_move(board, timeout_secs, Some(threads), evaluator))
     } else {
-        // キャッシュを初期化
-        let cache = Cache::new();
-
-        // 盤面をシリアライズしてキャッシュキーを生成
-        let board_state = board.serialize();
-
-        // キャッシュから結果を読み込む
-        if let Some(cached_move) =
-            cache.read(&board_state, args.timeout, args.threads, args.evaluate)
-        {
-            eprintln!("; Using cached result");
-            cached_move
-        } else {
-            // 反復深化探索を実行
-            if let Some(n) = args.threads {
-                eprintln!(
-                    "; Using iterative deepening with timeout {}s (parallel, {} threads)",
-                    args.timeout, n
-                );
-            } else {
-                eprintln!(
-                    "; Using iterative deepening with timeout {}s (serial)",
-                    args.timeout
-                );
+        choose_move(board, timeout_secs, None, evaluator)
+    }
+}
+
+/// 常駐モード
+///
+/// 標準入力から1行に1コマンドを読み、応答の最後に `ok` または `error <理由>` の行を出力する
+/// * `position [手 ...]` - 初期配置から棋譜を適用した局面を設定する
+/// * `move <手> [手 ...]` - 現在の局面に手を追加で適用する
+/// * `print` - 現在の局面の駒配置をFENの盤面フィールド形式で1行出力する
+/// * `go <timeout> [threads] [evaluator]` - 現在の局面の最善手をSAN形式で出力する
+fn run_daemon() -> Result<(), Box<dyn std::error::Error>> {
+    let mut board = Board::new();
+
+    for line in io::stdin().lock().lines() {
+        let line = line?;
+        let mut tokens = line.split_whitespace();
+        let result = match tokens.next() {
+            None => continue,
+            Some("position") => play_tokens(tokens).map(|b| board = b),
+            Some("move") => {
+                // 途中で失敗した場合に局面が中途半端に進まないよう、複製に適用してから置き換える
+                let mut next = board.clone();
+                tokens
+                    .try_for_each(|tok| next.parse_and_play_token(tok))
+                    .map(|()| board = next)
             }
-            let timeout = Duration::from_secs(args.timeout);
-            let san = if let Some(best_move) = board.find_best_move(timeout, args.threads) {
-                board.move_to_san(best_move)
-            } else {
-                eprintln!("No legal moves available");
-                return Err("No legal moves".into());
-            };
-
-            // キャッシュに保存
-            if let Err(e) = cache.write(
-                &board_state,
-                args.timeout,
-                args.threads,
-                args.evaluate,
-                &san,
-            ) {
-                eprintln!("; Warning: Failed to write cache: {}", e);
+            Some("print") => {
+                println!("{}", board.board_fen());
+                Ok(())
             }
-            san
+            Some("go") => match daemon_go(&board, tokens) {
+                Ok((san, pending)) => {
+                    // キャッシュへの書き込みを待たせないよう、先に応答を返す
+                    println!("{}", san);
+                    println!("ok");
+                    io::stdout().flush()?;
+                    if let Some(pending) = pending {
+                        pending.save();
+                    }
+                    continue;
+                }
+                Err(e) => Err(e),
+            },
+            Some(cmd) => Err(format!("Unknown command: {}", cmd)),
+        };
+        match result {
+            Ok(()) => println!("ok"),
+            Err(e) => println!("error {}", e),
+        }
+        io::stdout().flush()?;
+    }
+
+    Ok(())
+}
+
+/// メイン関数
+///
+/// 標準入力から棋譜を読み込み、AIが次の最善手を計算して出力する
+/// コマンドライン引数でタイムアウトを指定可能（デフォルト5秒）
+/// `--daemon` を指定した場合は常駐モードで起動する
+fn main() -> Result<(), Box<dyn std::error::Error>> {
+    let args = Args::parse();
+
+    if args.daemon {
+        return run_daemon();
+    }
+
+    // 評価関数の種類を設定
+    evaluate::set_evaluator_type(args.evaluate);
+
+    // 標準入力から棋譜（空白区切りの手）を読み、順次適用
+    let mut buf = String::new();
+    io::stdin().read_to_string(&mut buf)?;
+    let mut board = match play_tokens(buf.split_whitespace()) {
+        Ok(board) => board,
+        Err(e) => {
+            eprintln!("{}", e);
+            return Err(e.into());
         }
     };
 
+    // print_only モードなら盤面を表示して終了
+    if args.print_only {
+        board.print_as_comment();
+        return Ok(());
+    }
+
+    let (san, pending) = choose_move(&board, args.timeout, args.threads, args.evaluate)?;
+    if let Some(pending) = pending {
+        pending.save();
+    }
+
     // 最善手を出力
     println!("{}", san);
 